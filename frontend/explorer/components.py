@@ -587,7 +587,7 @@ class Aggregation(GroupedComponent):
             [
                 dbc.Input(
                     type="text",
-                    pattern=r"[a-zA-Z]+",
+                    pattern=LABEL_NAME.pattern,
                     id=self.gid(self.ID.LABEL_TEXT),
                     placeholder="Create Label",
                 ),
@@ -1,6 +1,7 @@
 # list of available graph layouts cytoscape.load_extra_layouts must be called
 import json
 import logging
+import re
 
 import networkx as nx
 
@@ -43,6 +44,10 @@ DELETE = "🗑"
 TREE = "🌲"
 AGGREGATE = "Aggregate"
 PROTECTED_NODE_LABELS = ["EtymologyEntry", "Entity", "NAE", "Multiword", "Wiktionary"]
+# valid names for user-created node labels
+LABEL_NAME = re.compile(r"[A-Za-z]+")
+# extracts the format from download items like "graph (json)"
+DOWNLOAD_FORMAT = re.compile(r"\w+ \((\w+)\)")
 NODE_COUNT_MESSAGE = "Displaying {} nodes"
 NOTHING_FOUND = "No matches found"
 
@@ -25,10 +25,25 @@ def expand_relations(selected_relations):
     return expand_dag_data(selected_relations, relation_tree)
 
 
-class NodeCypher:
-    def __init__(self, var: str, values: dict, dbconsts: Consts, path: str = None):
+class ParametrizedCypher:
+    def __init__(self, var: str, values: dict):
         self.var = var
         self.values = values
+        # query parameters, filled while rendering the clauses
+        self.params = {}
+
+    def param(self, name: str, value) -> str:
+        """
+        Register a query parameter and return its placeholder
+        """
+        key = f"{self.var}_{name}"
+        self.params[key] = value
+        return f"${key}"
+
+
+class NodeCypher(ParametrizedCypher):
+    def __init__(self, var: str, values: dict, dbconsts: Consts, path: str = None):
+        super().__init__(var, values)
         self.dbconsts = dbconsts
         self.path = path
 
@@ -46,10 +61,13 @@ class NodeCypher:
         term = values[NID.TERM_TEXT]
         cmp = "=~" if values[NID.TERM_REGEX] else "="
         if term:
-            term_clause = f'{var}.term {cmp} "{values[NID.TERM_TEXT]}" OR {var}.name {cmp} "{values[NID.TERM_TEXT]}"'
+            term_param = self.param("term", term)
+            term_clause = (
+                f"{var}.term {cmp} {term_param} OR {var}.name {cmp} {term_param}"
+            )
             if values[NID.TERM_NOT]:
-                term_clause = f"NOT ({term_clause}"
-            clauses.append(term_clause)
+                term_clause = f"NOT ({term_clause})"
+            clauses.append(f"({term_clause})")
 
         languages = [Consts.to_code(l) for l in values[NID.LANGUAGES] or []]
         if values[NID.LANGUAGE_CHILDREN]:
@@ -57,26 +75,24 @@ class NodeCypher:
         language_invert = "NOT " if values[NID.LANGUAGES_NOT] else ""
         if languages:
             clauses.append(
-                f"NOT EXISTS({var}.language) OR ({language_invert}{var}.language IN {as_cypher_list(languages)})"
+                f"(NOT EXISTS({var}.language) OR ({language_invert}{var}.language IN {self.param('languages', sorted(languages))}))"
             )
 
         sense_idx = values[NID.SENSE_IDX]
         if sense_idx is not None:
-            clauses.append(f"{var}.sense_idx = {sense_idx}")
+            clauses.append(f"({var}.sense_idx = {self.param('sense_idx', sense_idx)})")
 
         labels = values[NID.LABELS]
         labels_not = values[NID.LABELS_NOT]
         labels_joiner = "ALL" if values[NID.LABELS_JOINER] == AND else "ANY"
         if labels:
-            label_clause = (
-                f"{labels_joiner}(label in LABELS({var}) WHERE label IN {labels})"
-            )
+            label_clause = f"{labels_joiner}(label in LABELS({var}) WHERE label IN {self.param('labels', labels)})"
             if labels_not:
                 label_clause = "NOT " + label_clause
-            clauses.append(label_clause)
+            clauses.append(f"({label_clause})")
         if not clauses:
             return ""
-        node_filter = " AND ".join([f"({c})" for c in clauses])
+        node_filter = " AND ".join(clauses)
         if self.path:
             return f"ALL({self.var} IN NODES({self.path}) WHERE {node_filter})"
         return node_filter
@@ -141,23 +157,22 @@ class NodeCypher:
         cmp = "=~" if values[NID.GLOSS_REGEX] else "="
         glosslabels = values[NID.GLOSS_LABELS]
         if pos:
+            pos_param = self.param("pos", pos)
             # we compare a list of pos per etymology entry to a list of allowed pos
             # if negated return all nodes where any pos is not in the allowed list
             if values[NID.POS_NOT]:
-                clauses.append(
-                    f"ANY(p IN {self.posvar} WHERE NOT p IN {as_cypher_list(pos)})"
-                )
+                clauses.append(f"(ANY(p IN {self.posvar} WHERE NOT p IN {pos_param}))")
             # else return all nodes where any pos is in the allowed list
             else:
-                clauses.append(
-                    f"ANY(p IN {self.posvar} WHERE p IN {as_cypher_list(pos)})"
-                )
+                clauses.append(f"(ANY(p IN {self.posvar} WHERE p IN {pos_param}))")
 
         if gloss:
-            clauses.append(f'ANY(gloss in {self.glossvar} WHERE gloss {cmp} "{gloss}")')
+            clauses.append(
+                f"(ANY(gloss in {self.glossvar} WHERE gloss {cmp} {self.param('gloss', gloss)}))"
+            )
         if glosslabels:
             clauses.append(
-                f"ANY(gl IN {self.glosslabelvar} WHERE gl IN {as_cypher_list(glosslabels)})"
+                f"(ANY(gl IN {self.glosslabelvar} WHERE gl IN {self.param('glosslabels', glosslabels)}))"
             )
         return " AND ".join(clauses)
 
@@ -169,7 +184,7 @@ class IDMatchCypher(NodeCypher):
 
     @property
     def filters(self):
-        return f"ID({self.var}) = {self.id}"
+        return f"ID({self.var}) = {self.param('id', int(self.id))}"
 
     def attrselect(self, keep: List[str]):
         return "", keep
@@ -179,11 +194,7 @@ class IDMatchCypher(NodeCypher):
         return ""
 
 
-class RelationCypher:
-    def __init__(self, var: str, values: dict):
-        self.var = var
-        self.values = values
-
+class RelationCypher(ParametrizedCypher):
     @property
     def filter(self):
         RID = RelationSelect.ID
@@ -192,7 +203,7 @@ class RelationCypher:
             selected = expand_relations(selected)
         exclude = as_cypher_list(["HAS_POS", "HAS_GLOSS", "HAS_PRONUC"])
         return (
-            f"ALL({self.relvar} IN {self.var} WHERE TYPE({self.relvar}) IN {as_cypher_list(selected)} AND NOT "
+            f"ALL({self.relvar} IN {self.var} WHERE TYPE({self.relvar}) IN {self.param('types', sorted(selected))} AND NOT "
             f"TYPE({self.relvar}) IN {exclude})"
         )
 
@@ -1,6 +1,5 @@
 import math
-from collections import defaultdict
-from typing import Union, Tuple, List, Dict, Iterable, Collection
+from typing import Tuple, List, Dict, Iterable, Collection
 
 import networkx as nx
 from neo4j.graph import Node, Relationship
@@ -8,27 +7,42 @@ from neo4j.graph import Node, Relationship
 from etymmap.graph import RelationType
 from utils import random_color
 
+# the element store keeps nodes and edges apart, keyed by their id:
+# {"nodes": {id: element}, "edges": {id: element}}
+Elements = Dict[str, Dict[str, dict]]
 
-def element_id(element: dict) -> Union[str, Tuple[str, str]]:
+
+def element_id(element: dict) -> str:
     d = element["data"]
-    try:
-        return d["id"]
-    except KeyError:
-        return d["source"], d["target"]
+    id_ = d.get("id")
+    if id_ is not None:
+        return id_
+    # plain cyto edges may have no id
+    return f"{d['source']}-{d['target']}"
+
+
+def prune(clicked_element: dict, elements: Elements) -> Tuple[Elements, int]:
+    return remove_elements(split_elements([{"data": clicked_element}]), elements)
 
 
-def prune(clicked_element: dict, elements: List[dict]) -> Tuple[List[dict], int]:
-    return remove_elements([{"data": clicked_element}], elements)
+def split_elements(elements: List[dict]) -> Elements:
+    """
+    Convert a flat list of cytoscape elements into the element store layout
+    """
+    ret = {"nodes": {}, "edges": {}}
+    for e in elements:
+        ret["edges" if "source" in e["data"] else "nodes"][element_id(e)] = e
+    return ret
 
 
 def to_cyto_elements(
     nodes: Iterable[Node],
     relations: Iterable[Relationship],
     source_ids: Collection[str],
-) -> Tuple[List[dict], int]:
+) -> Tuple[Elements, int]:
     source_ids = set(source_ids)
 
-    node_data = []
+    node_data = {}
     for node in nodes:
         if node.get("term"):
             data = parse_node(node)
@@ -44,76 +58,57 @@ def to_cyto_elements(
             d["classes"] = "source"
         elif node.get("count_*"):
             d["classes"] = "agg"
-        node_data.append(d)
+        node_data[data["id"]] = d
 
-    relation_data = [
-        {
-            "data": parse_relation(r),
+    relation_data = {}
+    for r in relations:
+        data = parse_relation(r)
+        relation_data[data["id"]] = {
+            "data": data,
             "classes": "directed" if RelationType[r.type].directed else "",
         }
-        for r in relations
-    ]
 
-    elements = [*node_data, *relation_data]
+    elements = {"nodes": node_data, "edges": relation_data}
     n_elements = len(node_data)
 
     return elements, n_elements
 
 
 def add_elements(
-    new_elements: List[dict], current_elements: List[dict]
-) -> Tuple[List[dict], int]:
+    new_elements: Elements, current_elements: Elements
+) -> Tuple[Elements, int]:
     return combine_elements(new_elements, current_elements, False)
 
 
 def remove_elements(
-    del_elements: List[dict], current_elements: List[dict]
-) -> Tuple[List[dict], int]:
+    del_elements: Elements, current_elements: Elements
+) -> Tuple[Elements, int]:
     return combine_elements(del_elements, current_elements, True)
 
 
 def combine_elements(
-    change_elements: List[dict], current_elements: List[dict], remove=False
-):
-    change_nodes, change_edges, _ = split_nodes_edges(change_elements)
-    current_nodes, current_edges, current_connected = split_nodes_edges(
-        current_elements
-    )
-
+    change_elements: Elements, current_elements: Elements, remove=False
+) -> Tuple[Elements, int]:
     if remove:
-        for n in change_nodes:
-            del current_nodes[n]
-            if n in current_connected:
-                for e in current_connected[n]:
-                    del current_edges[e]
-        for n in change_edges:
-            del current_edges[n]
+        removed_nodes = change_elements["nodes"].keys()
+        nodes = {
+            id_: n
+            for id_, n in current_elements["nodes"].items()
+            if id_ not in removed_nodes
+        }
+        # also drop the edges that would lose an endpoint
+        edges = {
+            id_: e
+            for id_, e in current_elements["edges"].items()
+            if id_ not in change_elements["edges"]
+            and e["data"]["source"] not in removed_nodes
+            and e["data"]["target"] not in removed_nodes
+        }
     else:
-        current_nodes.update(change_nodes)
-        current_edges.update(change_edges)
-
-    nodes = list(current_nodes.values())
-    edges = list(current_edges.values())
-
-    return nodes + edges, len(nodes)
+        nodes = {**current_elements["nodes"], **change_elements["nodes"]}
+        edges = {**current_elements["edges"], **change_elements["edges"]}
 
-
-def split_nodes_edges(
-    elements: List[dict],
-) -> Tuple[Dict[str, dict], Dict[str, dict], Dict[str, List[str]]]:
-    nodes = {}  # node.id -> node
-    edges = defaultdict()  # rel.id, src.id, tgt.id -> rel
-    connected = defaultdict(list)  # node.id -> rel.id
-    for e in elements:
-        d = e["data"]
-        try:
-            nodes[d["id"]] = e
-        except KeyError:
-            id_, source, target = d["rel_id"], d["source"], d["target"]
-            edges[id_] = e
-            connected[source].append(id_)
-            connected[target].append(id_)
-    return nodes, edges, connected
+    return {"nodes": nodes, "edges": edges}, len(nodes)
 
 
 def parse_node(node: Node) -> dict:
@@ -3,6 +3,7 @@ import re
 
 import networkx as nx
 
+from cyto_elements import convert_family_tree
 from etymmap.specific import Specific
 from etymmap.specific_en import languages, configure
 
@@ -21,6 +22,8 @@ class Consts:
         self.gloss_labels = gloss_labels
         self.node_labels = node_labels
         self.combined_language_tree = self.make_combined_tree(db_languages)
+        # the tree is static, so the cytoscape elements are converted only once
+        self.language_tree_elements = convert_family_tree(self.combined_language_tree)
         self.languages = sorted(
             [self.to_display(*l) for l in self.combined_language_tree.nodes]
         )
@@ -36,9 +39,31 @@ class Consts:
         return re.match(r".* \((.*)\)\*?$", repr_).group(1)
 
     def make_language_family_tree(self, db_languages):
+        # many languages share the same parent, so resolve each name only once
+        name2codes = {}
+        name2code = {}
+        is_family = {}
+
+        def get_codes(name):
+            if name not in name2codes:
+                name2codes[name] = Specific.language_mapper.name2code(
+                    name, allow_ambiguity=True
+                )
+            return name2codes[name]
+
+        def get_code(name):
+            if name not in name2code:
+                name2code[name] = Specific.language_mapper.name2code(name)
+            return name2code[name]
+
+        def check_family(code):
+            if code not in is_family:
+                is_family[code] = Specific.language_mapper.is_family(code)
+            return is_family[code]
+
         def get_family_code(name):
-            codes = Specific.language_mapper.name2code(name, allow_ambiguity=True)
-            fcodes = [c for c in codes if Specific.language_mapper.is_family(c)]
+            codes = get_codes(name)
+            fcodes = [c for c in codes if check_family(c)]
             if not fcodes:
                 print(f"Not a family {name} ({fcodes}, {codes})")
                 return codes[0]
@@ -75,7 +100,7 @@ class Consts:
                 if data.get("Parent"):
                     src = (
                         data["Parent"],
-                        Specific.language_mapper.name2code(data["Parent"]),
+                        get_code(data["Parent"]),
                         "L",
                     )
                 else:
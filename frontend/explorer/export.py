@@ -113,4 +113,5 @@ def to_export_excel(nodes, relationships) -> str:
             writer, sheet_name="Pronunciation"
         )
         entity_frame.to_excel(writer, sheet_name="Entities")
-    return base64.b64encode(data.getvalue()).decode()
+    # encode from a view on the buffer, getvalue() would copy the whole workbook first
+    return base64.b64encode(data.getbuffer()).decode()
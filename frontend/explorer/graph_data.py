@@ -6,12 +6,18 @@ import dash_html_components as html
 from dash import dcc
 
 from consts import LAYOUTS, DEFAULT_LAYOUT, relation_tree
-from cyto_elements import convert_family_tree, convert_relation_tree
+from cyto_elements import convert_relation_tree, split_elements
 from dbconsts import Consts
 from utils import id_merge
 
+# the type of the element store ids, versioned with the shape of the stored data:
+# session storage is keyed by the id, so data of an older shape is not read back
+ELEMENT_STORE = "element-store-v2"
+
 cyto.load_extra_layouts()
 
+relation_tree_elements = convert_relation_tree(relation_tree)
+
 etym_graph_style = [
     {
         "selector": "node",
@@ -85,7 +91,7 @@ def initialized_graphs(etymology, languages, relations, dbconsts: Consts):
     )
     language_tree = wrap_graph(
         languages,
-        convert_family_tree(dbconsts.combined_language_tree),
+        dbconsts.language_tree_elements,
         stylesheet=data_graph_style,
         layout={
             "name": "klay",
@@ -102,7 +108,7 @@ def initialized_graphs(etymology, languages, relations, dbconsts: Consts):
     )
     cyto_relation_tree = wrap_graph(
         relations,
-        convert_relation_tree(relation_tree),
+        relation_tree_elements,
         stylesheet=data_graph_style,
         layout={
             "name": "dagre",
@@ -151,9 +157,9 @@ def wrap_graph(
         children.extend(
             [
                 dcc.Store(
-                    id=id_merge({"type": "element-store"}, id_),
+                    id=id_merge({"type": ELEMENT_STORE}, id_),
                     storage_type="session",
-                    data=elements,
+                    data=split_elements(elements or []),
                 ),
                 dcc.Store(
                     id=id_merge({"type": "cypher-history"}, id_),
@@ -1,13 +1,14 @@
 import argparse
 import datetime
 import json
-import re
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import Optional
 
 import dash_bootstrap_components as dbc
 import dash_cytoscape as cyto
 import dash_html_components as html
+import orjson
 from dash import Dash, State, Input, Output, MATCH, ALL, dash, dcc
 from dash.exceptions import PreventUpdate
 
@@ -29,15 +30,25 @@ from consts import (
     PRUNE,
     EXPAND,
     PROTECTED_NODE_LABELS,
+    LABEL_NAME,
+    DOWNLOAD_FORMAT,
 )
 from cyto_elements import prune, combine_elements, to_cyto_elements
 from dbconsts import Consts
 from etymmap.specific import Specific
 from export import to_export_json, to_export_excel
-from graph_data import initialized_graphs
-from neo4jconnector import Neo4jConnector, SearchTooBroad, Neo4jConfig, default_config
+from graph_data import initialized_graphs, ELEMENT_STORE
+from neo4jconnector import (
+    Neo4jConnector,
+    EtymGraphSession,
+    SearchTooBroad,
+    Neo4jConfig,
+    default_config,
+)
 from utils import (
     get_trigger,
+    stringify_id,
+    LRUCache,
     to_options,
     get_node_ids,
     id_merge,
@@ -47,6 +58,17 @@ from utils import (
 cyto.load_extra_layouts()
 
 
+@lru_cache(maxsize=4096)
+def language_name(code: str) -> str:
+    """
+    The name of a language code, or the code itself if it is unknown
+    """
+    try:
+        return Specific.language_mapper.code2name(code)
+    except KeyError:
+        return code
+
+
 def create(neo_config: Neo4jConfig = default_config):
     app = Dash(
         title="Etymmap 2.0",
@@ -60,12 +82,8 @@ def create(neo_config: Neo4jConfig = default_config):
 
     app.neo4j = Neo4jConnector(neo_config)
 
-    with app.neo4j.new_session() as session:
-        LANGUAGES = session.get_all_languages()
-        POS = session.get_all_pos()
-        GLOSS_LABELS = session.get_glosslabels()
-        LABELS = session.get_node_labels()
-        LABELS.remove("Word")
+    LANGUAGES, POS, GLOSS_LABELS, LABELS = app.neo4j.get_db_constants()
+    LABELS.remove("Word")
 
     dbconsts = Consts(LANGUAGES, POS, GLOSS_LABELS, LABELS)
     app.logger.info(
@@ -118,19 +136,25 @@ def create(neo_config: Neo4jConfig = default_config):
     # Utility #
     ###########
 
-    @app.callback(
+    # the select buttons only change their own color, so this is done in the browser
+    # indent the clicked button
+    app.clientside_callback(
+        """function(_, color) {
+            return color === "secondary" ? "primary" : "secondary";
+        }""",
         Output({"type": "select-button", "group": MATCH, "id": MATCH}, "color"),
         Input({"type": "select-button", "group": MATCH, "id": MATCH}, "n_clicks"),
         State({"type": "select-button", "group": MATCH, "id": MATCH}, "color"),
         prevent_initial_call=True,
     )
-    def cb_select_button_clicked(_, color):
-        """
-        Indent the clicked button
-        """
-        return "primary" if color == "secondary" else "secondary"
 
-    @app.callback(
+    # indent only the clicked button of the group
+    app.clientside_callback(
+        """function(_, ids) {
+            const propId = dash_clientside.callback_context.triggered[0].prop_id;
+            const trigger = JSON.parse(propId.slice(0, propId.lastIndexOf(".")));
+            return ids.map(i => i.idx === trigger.idx ? "primary" : "secondary");
+        }""",
         Output(
             {"type": "select-button-group", "group": MATCH, "id": MATCH, "idx": ALL},
             "color",
@@ -145,18 +169,16 @@ def create(neo_config: Neo4jConfig = default_config):
         ),
         prevent_initial_call=True,
     )
-    def cb_select_button_group_clicked(_, ids):
-        trigger = get_trigger()
-        trigger_id = json.loads(trigger[0])
-        return ["primary" if i == trigger_id else "secondary" for i in ids]
 
-    @app.callback(
+    # copy the stored elements into the graph in the browser, without a server roundtrip
+    app.clientside_callback(
+        """function(elements) {
+            return Object.values(elements.nodes).concat(Object.values(elements.edges));
+        }""",
         Output({"type": "graph", "id": ETYMOLOGY_GRAPH}, "elements"),
-        Input({"type": "element-store", "id": ETYMOLOGY_GRAPH}, "data"),
+        Input({"type": ELEMENT_STORE, "id": ETYMOLOGY_GRAPH}, "data"),
         prevent_initial_call=True,
     )
-    def update_graph(elements):
-        return elements
 
     ######################
     # Basic interactions #
@@ -203,7 +225,7 @@ def create(neo_config: Neo4jConfig = default_config):
         prevent_initial_call=True,
     )
     def switch_tree_close_visibility(_, __, current_hidden):
-        if json.loads(get_trigger()[0]) == relation_select.gid(
+        if orjson.loads(get_trigger()[0]) == relation_select.gid(
             relation_select.ID.SHOW_LANGUAGES
         ):
             if current_hidden[1]:
@@ -215,29 +237,26 @@ def create(neo_config: Neo4jConfig = default_config):
     @app.callback(
         Output(navbar.gid(navbar.ID.DOWNLOAD), "data"),
         Input(id_merge(navbar.gid(navbar.ID.DOWNLOAD), {"item": ALL}), "n_clicks"),
-        State({"type": "element-store", "id": ETYMOLOGY_GRAPH}, "data"),
+        State({"type": ELEMENT_STORE, "id": ETYMOLOGY_GRAPH}, "data"),
         State({"type": "cypher-history", "id": ETYMOLOGY_GRAPH}, "data"),
         prevent_initial_call=True,
     )
-    def download_data(_, current_elements: list, history: list):
+    def download_data(_, current_elements: dict, history: list):
         trigger = get_trigger()
-        trigger_id = json.loads(trigger[0])["item"]
+        trigger_id = orjson.loads(trigger[0])["item"]
         if "graph" in trigger_id:
-            node_ids = []
-            rel_ids = []
-            for d in current_elements:
-                dd = d["data"]
-                if "source" in dd:
-                    rel_ids.append(dd["id"])
-                else:
-                    node_ids.append(dd["id"])
-            nodes, relationships = session.export_selection(node_ids, rel_ids)
-            format_ = re.match(r"\w+ \((\w+)\)", trigger_id).group(1)
+            node_ids = list(current_elements["nodes"])
+            rel_ids = list(current_elements["edges"])
+            nodes, relationships = app.neo4j.read_tx(
+                EtymGraphSession.export_selection, node_ids, rel_ids, fetch_size=-1
+            )
+            format_ = DOWNLOAD_FORMAT.match(trigger_id).group(1)
             if format_ == "json":
-                return dcc.send_string(
-                    json.dumps(
+                return dcc.send_bytes(
+                    orjson.dumps(
                         to_export_json(nodes, relationships),
-                        indent=2,
+                        option=orjson.OPT_INDENT_2,
+                        default=str,
                     ),
                     "graph.json",
                 )
@@ -253,8 +272,25 @@ def create(neo_config: Neo4jConfig = default_config):
     # `THE` Interactivity callback #
     ################################
 
+    # rendered details of lexical nodes, they only change with the node labels
+    rendered_details = LRUCache(512)
+
+    # map the serialized trigger ids to the interaction they stand for
+    interactions = {
+        stringify_id(id_): action
+        for id_, action in [
+            (navbar.gid(navbar.ID.SUBMIT_SEARCH), "DO_SEARCH"),
+            (navbar.gid(navbar.ID.AGGREGATE_BUTTON), "AGGREGATE"),
+            (aggregation.gid(aggregation.ID.LABEL_CREATE_BUTTON), "CREATE_LABEL"),
+            (aggregation.gid(aggregation.ID.LABEL_DELETE_CONFIRM), "DELETE_LABEL"),
+            (aggregation.gid(aggregation.ID.LABEL_RELOAD), "RELOAD_LABEL"),
+            (navbar.gid(navbar.ID.LAYOUT_SELECT), "CHANGE_LAYOUT"),
+            ({"type": "graph", "id": ETYMOLOGY_GRAPH}, "GRAPH_TAP"),
+        ]
+    }
+
     @app.callback(
-        Output({"type": "element-store", "id": ETYMOLOGY_GRAPH}, "data"),
+        Output({"type": ELEMENT_STORE, "id": ETYMOLOGY_GRAPH}, "data"),
         Output({"type": "cypher-history", "id": ETYMOLOGY_GRAPH}, "data"),
         Output(navbar.gid(navbar.ID.N_NODES), "children"),
         Output(navbar.gid(navbar.ID.N_NODES), "style"),
@@ -286,7 +322,7 @@ def create(neo_config: Neo4jConfig = default_config):
             ),
             "options",
         ),
-        State({"type": "element-store", "id": ETYMOLOGY_GRAPH}, "data"),
+        State({"type": ELEMENT_STORE, "id": ETYMOLOGY_GRAPH}, "data"),
         State({"type": "cypher-history", "id": ETYMOLOGY_GRAPH}, "data"),
     )
     def interact_graph(
@@ -312,7 +348,7 @@ def create(neo_config: Neo4jConfig = default_config):
         current_history,
     ):
         trigger = get_trigger()
-        new_layout = json.loads(new_layout)
+        n_label_dropdowns = len(all_label_dropdowns)
 
         app.logger.debug(f"Interaction trigger: {trigger}")
 
@@ -335,45 +371,32 @@ def create(neo_config: Neo4jConfig = default_config):
                 show_details,
                 details_component,
                 layout,
-                tuple(updated_labels for _ in all_label_dropdowns),
+                # one entry per label dropdown, all share the same options
+                [updated_labels] * n_label_dropdowns,
             )
 
         if trigger[0] == DETAILS_CLOSE:
             return ret(show_details=False)
 
-        # initial search query
-        if not trigger[0]:
-            trigger_id = ""
-        else:
-            # for all other inputs we expect json as ids
-            trigger_id = json.loads(trigger[0])
+        # an empty trigger is the initial search query
+        initial_query = not trigger[0]
+        action = interactions.get(trigger[0])
 
         # make the condition better readable
-        (
-            DO_SEARCH,
-            AGGREGATE,
-            CREATE_LABEL,
-            DELETE_LABEL,
-            RELOAD_LABEL,
-            CHANGE_LAYOUT,
-            GRAPH_TAP,
-        ) = [
-            id_ == trigger_id
-            for id_ in [
-                navbar.gid(navbar.ID.SUBMIT_SEARCH),
-                navbar.gid(navbar.ID.AGGREGATE_BUTTON),
-                aggregation.gid(aggregation.ID.LABEL_CREATE_BUTTON),
-                aggregation.gid(aggregation.ID.LABEL_DELETE_CONFIRM),
-                aggregation.gid(aggregation.ID.LABEL_RELOAD),
-                navbar.gid(navbar.ID.LAYOUT_SELECT),
-                {"type": "graph", "id": ETYMOLOGY_GRAPH},
-            ]
-        ]
+        DO_SEARCH = action == "DO_SEARCH"
+        AGGREGATE = action == "AGGREGATE"
+        CREATE_LABEL = action == "CREATE_LABEL"
+        DELETE_LABEL = action == "DELETE_LABEL"
+        RELOAD_LABEL = action == "RELOAD_LABEL"
+        CHANGE_LAYOUT = action == "CHANGE_LAYOUT"
+        GRAPH_TAP = action == "GRAPH_TAP"
 
         if CHANGE_LAYOUT:
-            return ret(layout=new_layout)
+            return ret(layout=orjson.loads(new_layout))
 
         if any([AGGREGATE, CREATE_LABEL, DELETE_LABEL, RELOAD_LABEL]):
+            if not AGGREGATE:
+                rendered_details.clear()
             aggregation_values = aggregation.values(aggregation_state)
             new_label_text = aggregation_values[aggregation.ID.LABEL_TEXT]
             selected_labels = aggregation_values[aggregation.ID.SELECTED_LABELS]
@@ -390,7 +413,11 @@ def create(neo_config: Neo4jConfig = default_config):
                         status_style=STATUS_STYLE_NORMAL,
                     )
                 if CREATE_LABEL:
-                    if not re.fullmatch("[a-zA-z]+", new_label_text):
+                    if (
+                        not new_label_text
+                        or not LABEL_NAME.fullmatch(new_label_text)
+                        or new_label_text in PROTECTED_NODE_LABELS
+                    ):
                         return ret(
                             status="Invalid label name",
                             status_style=STATUS_STYLE_WARNING,
@@ -408,12 +435,10 @@ def create(neo_config: Neo4jConfig = default_config):
                     if not selected_labels:
                         raise PreventUpdate()
                     session.delete_node_labels(selected_labels)
+                    deleted = set(selected_labels).difference(PROTECTED_NODE_LABELS)
                     return ret(
                         updated_labels=[
-                            l
-                            for l in current_labels
-                            if not l["value"]
-                            in set(selected_labels).difference(PROTECTED_NODE_LABELS)
+                            l for l in current_labels if l["value"] not in deleted
                         ]
                     )
                 elif RELOAD_LABEL:
@@ -448,31 +473,27 @@ def create(neo_config: Neo4jConfig = default_config):
                 # do not expand on relation click
                 raise PreventUpdate()
 
-        if DO_SEARCH or not trigger_id:
+        if DO_SEARCH or initial_query:
             simple_search_term = navbar_values[navbar.ID.SIMPLE_SEARCH_TERM]
             expand_use_config = navbar_values[navbar.ID.ONCLICK_USE_SUBGRAPH_CONFIG]
             node_id = event_data["id"] if event_data else None
+            history_record = HistoryRecord(query_ts=datetime.datetime.utcnow())
             try:
-                with app.neo4j.new_session() as session:
-                    history_record = HistoryRecord(query_ts=datetime.datetime.utcnow())
-                    if (
-                        not simple_search_disabled
-                        or event_data
-                        and not expand_use_config
-                    ):
-                        nodes, relations, source_ids, query = session.simple_query(
-                            simple_search_term, 10, node_id
-                        )
-                    else:
-                        nodes, relations, source_ids, query = session.advanced_query(
-                            source_select.values(source_state),
-                            subgraph_select.values(subgraph_state),
-                            target_select.values(target_state),
-                            relation_select.values(relations_state),
-                            dbconsts,
-                            node_id,
-                        )
-                    history_record.query = query
+                if not simple_search_disabled or event_data and not expand_use_config:
+                    nodes, relations, source_ids, query = app.neo4j.read_tx(
+                        EtymGraphSession.simple_query, simple_search_term, 10, node_id
+                    )
+                else:
+                    nodes, relations, source_ids, query = app.neo4j.read_tx(
+                        EtymGraphSession.advanced_query,
+                        source_select.values(source_state),
+                        subgraph_select.values(subgraph_state),
+                        target_select.values(target_state),
+                        relation_select.values(relations_state),
+                        dbconsts,
+                        node_id,
+                    )
+                history_record.query = query
 
             except SearchTooBroad as e:
                 history_record.error = e.args[0]
@@ -553,11 +574,7 @@ def create(neo_config: Neo4jConfig = default_config):
 
         else:
             if "term" in event_data:
-                language = event_data.get("language", "")
-                try:
-                    language = Specific.language_mapper.code2name(language)
-                except KeyError:
-                    pass
+                language = language_name(event_data.get("language", ""))
                 children = [
                     html.H3(f"{event_data['term']} ({language})"),
                     html.Br(),
@@ -575,13 +592,18 @@ def create(neo_config: Neo4jConfig = default_config):
                     return dbc.Col(children)
 
                 # lexical nodes
-                with app.neo4j.new_session() as session:
-                    nodeid = int(event_data["id"])
-                    attrs = session.get_node_attrs([nodeid])[nodeid]
-                    labels = attrs["labels"]
-                    etymology = attrs.get("etymology", "")
-                    gloss_per_pos = attrs.get("gloss_per_pos")
-                    pronunciation = attrs.get("pronunciation")
+                nodeid = int(event_data["id"])
+                cached = rendered_details.get(nodeid)
+                if cached is not None:
+                    return cached
+                node_attrs = app.neo4j.read_tx(
+                    EtymGraphSession.get_node_attrs, [nodeid]
+                )
+                attrs = node_attrs[nodeid]
+                labels = attrs["labels"]
+                etymology = attrs.get("etymology", "")
+                gloss_per_pos = attrs.get("gloss_per_pos")
+                pronunciation = attrs.get("pronunciation")
 
                 children.extend(
                     [html.B("Graph-Labels:"), html.I(", ".join(labels)), html.Br()]
@@ -605,7 +627,7 @@ def create(neo_config: Neo4jConfig = default_config):
                     children.append(html.H4("Etmyology"))
                     children.extend(text2display(etymology))
                 if gloss_per_pos:
-                    for pos, glosses in sorted(gloss_per_pos.items()):
+                    for pos, glosses in gloss_per_pos.items():
                         children.append(html.H4(pos))
                         children.append(
                             html.Ul(
@@ -616,7 +638,9 @@ def create(neo_config: Neo4jConfig = default_config):
                             )
                         )
 
-                return dbc.Col(children)
+                rendered = dbc.Col(children)
+                rendered_details.put(nodeid, rendered)
+                return rendered
         return json.dumps(event_data, indent=2)
 
     return app
@@ -1,24 +1,40 @@
 import json
 import logging
-from collections import defaultdict
-from typing import List, Tuple
+from pathlib import Path
+from typing import List, Tuple, Callable, TypeVar, Union
 
 import neo4j
 from neo4j.graph import Relationship, Node
 
 from components import RelationSelect, NodeSelect
-from consts import PROTECTED_NODE_LABELS
+from consts import LABEL_NAME, PROTECTED_NODE_LABELS
 from cypher import NodeCypher, RelationCypher, IDMatchCypher
 from dbconsts import Consts
-from utils import as_cypher_list
 
 
 class Neo4jConfig:
-    def __init__(self, uri: str, database: str, auth, query_timeout=10):
+    def __init__(
+        self,
+        uri: str,
+        database: str,
+        auth,
+        query_timeout=10,
+        max_connection_pool_size=100,
+        connection_acquisition_timeout=60,
+        max_connection_lifetime=3600,
+        keep_alive=True,
+        fetch_size=1000,
+    ):
         self.uri = uri
         self.database = database
         self.auth = tuple(auth)
         self.query_timeout = query_timeout
+        # connection pool settings, passed on to the driver
+        self.max_connection_pool_size = max_connection_pool_size
+        self.connection_acquisition_timeout = connection_acquisition_timeout
+        self.max_connection_lifetime = max_connection_lifetime
+        self.keep_alive = keep_alive
+        self.fetch_size = fetch_size
 
     def __repr__(self):
         return f"[{self.uri}/{self.database}, auth: {self.auth}]"
@@ -32,14 +48,36 @@ default_config = Neo4jConfig(
 )
 
 
+DBCONSTS_CACHE = Path.home() / ".cache" / "etymmap" / "dbconsts.json"
+
+
 class SearchTooBroad(BaseException):
     pass
 
 
+def with_params(cypher: str, params: dict) -> str:
+    """
+    Render a query together with its parameters, as it can be run in the neo4j browser
+    """
+    if not params:
+        return cypher
+    return f":params {json.dumps(params)}\n{cypher}"
+
+
+def quote_label(label: str) -> str:
+    """
+    Quote a label as a cypher identifier, labels cannot be parameters
+    """
+    return "`" + label.replace("`", "``") + "`"
+
+
+T = TypeVar("T")
+
+
 class EtymGraphSession:
-    def __init__(self, session: neo4j.Session):
+    def __init__(self, session: Union[neo4j.Session, neo4j.Transaction]):
         self.session = session
-        self.logger = logging.getLogger(str(self))
+        self.logger = logging.getLogger("EtymGraphSession")
 
     def __enter__(self):
         self.session.__enter__()
@@ -48,9 +86,16 @@ class EtymGraphSession:
     def __exit__(self, *args, **kwargs):
         self.session.__exit__(*args, **kwargs)
 
-    def cypher(self, cypher: str):
+    def cypher(self, cypher: str, **params):
         self.logger.debug(cypher)
-        yield from self.session.run(cypher)
+        yield from self.session.run(cypher, params)
+
+    def single(self, cypher: str, **params):
+        """
+        Run a query that returns (at most) one record, without buffering a list
+        """
+        self.logger.debug(cypher)
+        return self.session.run(cypher, params).single()
 
     def simple_query(
         self, term: str, limit: int, id: int
@@ -59,22 +104,24 @@ class EtymGraphSession:
         Just match the term and find the neighbours
         """
         if id is None:
-            condition = f'WHERE source.term = "{term}" OR source.name = "{term}"'
+            condition = "WHERE source.term = $term OR source.name = $term"
+            params = {"term": term, "limit": limit}
         else:
-            condition = f"WHERE ID(source) = {id}"
+            condition = "WHERE ID(source) = $id"
+            params = {"id": int(id), "limit": limit}
         cypher = "\n".join(
             [
-                f"MATCH path=(source:Word)--(:Word)",
+                "MATCH path=(source:Word)--(:Word)",
                 condition,
-                f"WITH source, path",
-                f"LIMIT {limit}",
-                f"WITH apoc.agg.graph(path) as subgraph, COLLECT(DISTINCT ID(source)) as sources",
-                f"RETURN subgraph.nodes, subgraph.relationships, sources",
+                "WITH source, path",
+                "LIMIT $limit",
+                "WITH apoc.agg.graph(path) as subgraph, COLLECT(DISTINCT ID(source)) as sources",
+                "RETURN subgraph.nodes, subgraph.relationships, sources",
             ]
         )
-        return (*list(self.cypher(cypher))[0], cypher)
+        return (*self.single(cypher, **params), with_params(cypher, params))
 
-    def advanced_query(
+    def pattern_query(
         self,
         source_select: dict,
         subgraph_select: dict,
@@ -82,7 +129,7 @@ class EtymGraphSession:
         relationship_select: dict,
         dbconsts: Consts,
         node_id: int = None,
-    ):
+    ) -> Tuple[List[Node], List[Relationship], List[int], str]:
         """
         Find a subgraph around a set of source nodes
 
@@ -92,24 +139,6 @@ class EtymGraphSession:
         :param relationship_select: filter for the relations
         :return:
         """
-        return self.pattern_query(
-            source_select,
-            subgraph_select,
-            target_select,
-            relationship_select,
-            dbconsts,
-            node_id,
-        )
-
-    def pattern_query(
-        self,
-        source_select: dict,
-        subgraph_select: dict,
-        target_select: dict,
-        relationship_select: dict,
-        dbconsts: Consts,
-        node_id: int = None,
-    ) -> Tuple[List[Node], List[Relationship], List[int], str]:
         RID = RelationSelect.ID
         search_depth = relationship_select[RID.DEPTH]
 
@@ -178,7 +207,7 @@ class EtymGraphSession:
             if search_depth
             else f"WITH {source_cypher.var}"
         )
-        limit_clause += f"\nlimit {limit}"
+        limit_clause += "\nlimit $limit"
 
         if not search_depth:
             cypher = "\n".join(
@@ -203,88 +232,75 @@ class EtymGraphSession:
                     f"RETURN subgraph.nodes, subgraph.relationships, sources",
                 ]
             )
-        results = list(self.cypher(cypher))
-        if results:
-            return (*list(results[0]), cypher)
-        return [], [], [], cypher
+        params = {"limit": int(limit)}
+        for c in [source_cypher, subgraph_cypher, target_cypher, path_cypher]:
+            params.update(c.params)
+        record = self.single(cypher, **params)
+        if record is not None:
+            return (*record, with_params(cypher, params))
+        return [], [], [], with_params(cypher, params)
 
-    def subgraph_query(self):
-        pass
+    advanced_query = pattern_query
 
     def get_node_attrs(self, node_ids):
         node_ids = [int(i) for i in node_ids]
-        ret = defaultdict(dict)
-        for node, etymology in self.cypher(
-            f"""
-            MATCH (n)
-            WHERE ID(n) IN {node_ids}
-            RETURN ID(n), n.etymology
+        # one map per node, pattern comprehensions instead of OPTIONAL MATCH chains,
+        # so that pos, glosses and pronunciations do not multiply out
+        ret = {}
+        for node, attrs in self.cypher(
             """
-        ):
-            ret[node]["etymology"] = etymology
-
-        for node, labels in self.cypher(
-            f"""
             MATCH (n)
-            WHERE ID(n) IN {node_ids}
-            RETURN ID(n), LABELS(n)
-            """
-        ):
-            ret[node]["labels"] = labels
-
-        for node, pos in self.cypher(
-            f"""
-            MATCH (n)--(p:POS)
-            WHERE ID(n) IN {node_ids}
-            RETURN ID(n), p.type
-            """
-        ):
-            ret[node].setdefault("gloss_per_pos", {})[pos] = []
-
-        for node, pos, gloss in self.cypher(
-            f"""
-            MATCH (n)--(g:Gloss)--(p:POS)
-            WHERE ID(n) IN {node_ids} AND (g)--(p)
-            RETURN ID(n), p.type, g
-            """
+            WHERE ID(n) IN $ids
+            RETURN ID(n), n {
+                .etymology,
+                labels: LABELS(n),
+                gloss_per_pos: [(n)--(p:POS) | [p.type, [(n)--(g:Gloss)--(p) | g]]],
+                pronunciation: [(n)--(pr:Pronunc) | pr]
+            }
+            """,
+            ids=node_ids,
         ):
-            ret[node]["gloss_per_pos"][pos].append(gloss)
-
-        for node, prs in self.cypher(
-            f"""
-            MATCH (n)--(pr:Pronunc)
-            WHERE ID(n) IN {node_ids}
-            RETURN ID(n), collect(pr)
-            """
-        ):
-            ret[node]["pronunciation"] = prs
-
+            # order the pos once here, so that it can be displayed as is
+            attrs["gloss_per_pos"] = dict(
+                sorted(attrs["gloss_per_pos"], key=lambda pg: pg[0])
+            )
+            ret[node] = attrs
         return ret
 
     def get_node_neighbors(self, node_id):
         return list(
             self.cypher(
-                f"""
+                """
                 MATCH (n)--(n2:Word)
-                WHERE ID(n) = {node_id}
-                RETURN n2"""
+                WHERE ID(n) = $id
+                RETURN n2""",
+                id=int(node_id),
             )
         )
 
     def aggregate(self, labels: List[str], include_languages):
         if not labels and not include_languages:
             return [], 0
-        labels = as_cypher_list(labels)
-        properties = as_cypher_list(["language"] if include_languages else [])
-        return list(
-            self.cypher(
-                f"""
-                CALL apoc.nodes.group({labels}, {properties})
-                YIELD node, relationship
-                RETURN collect(node), collect(relationship)
-                """
-            )
-        )[0]
+        return self.single(
+            """
+            CALL apoc.nodes.group($labels, $properties)
+            YIELD node, relationship
+            RETURN collect(node), collect(relationship)
+            """,
+            labels=list(labels or []),
+            properties=["language"] if include_languages else [],
+        )
+
+    def get_fingerprint(self) -> list:
+        """
+        Cheap summary of the db state (answered from the count store), changes with imports and label edits
+        """
+        n_nodes = self.single("MATCH (n) RETURN count(n)")[0]
+        n_rels = self.single("MATCH ()-[r]->() RETURN count(r)")[0]
+        labels = sorted(
+            r["label"] for r in self.cypher("CALL db.labels() YIELD label RETURN label")
+        )
+        return [n_nodes, n_rels, labels]
 
     def get_all_languages(self):
         return [
@@ -296,11 +312,12 @@ class EtymGraphSession:
         return [
             record["t"]
             for record in self.cypher(
-                f"""
+                """
                 MATCH (pos:POS)--(n)
                 WITH DISTINCT pos.type AS t, COUNT(n) AS c
-                WHERE c >= {cutoff} RETURN t ORDER BY c DESC
-                """
+                WHERE c >= $cutoff RETURN t ORDER BY c DESC
+                """,
+                cutoff=cutoff,
             )
         ]
 
@@ -308,11 +325,12 @@ class EtymGraphSession:
         return [
             record["l"]
             for record in self.cypher(
-                f"""
+                """
                 MATCH (n:Gloss) UNWIND n.labels AS l
-                WITH l, count(l) AS c WHERE c >= {min}
+                WITH l, count(l) AS c WHERE c >= $min
                 RETURN l ORDER BY c DESC
-                """
+                """,
+                min=min,
             )
         ]
 
@@ -330,64 +348,147 @@ class EtymGraphSession:
         ]
 
     def create_node_label(self, name: str, selected_ids: List[str]) -> None:
+        # labels cannot be parameters, so the name is validated before interpolation
+        if not LABEL_NAME.fullmatch(name) or name in PROTECTED_NODE_LABELS:
+            raise ValueError(f"Invalid label name: {name}")
         cypher = "\n".join(
             [
+                "UNWIND $ids AS id",
                 "MATCH (n)",
-                f"WHERE ID(n) IN {[int(i) for i in selected_ids]}",
+                "WHERE ID(n) = id",
                 f"SET n:{name}",
-                "RETURN n",
             ]
         )
-        list(self.cypher(cypher))
+        list(self.cypher(cypher, ids=[int(i) for i in selected_ids]))
 
     def delete_node_labels(self, names: List[str]):
         if not names:
             return
-        labels = set(names).difference(PROTECTED_NODE_LABELS)
-        for label in labels:
-            list(
-                self.cypher(
-                    f"""
-                    MATCH (n:{label})
-                    REMOVE n:{label}
-                    RETURN n
-                    """
-                )
-            )
+        # existing labels may not match LABEL_NAME, so they are quoted instead of validated
+        labels = [
+            quote_label(label) for label in set(names).difference(PROTECTED_NODE_LABELS)
+        ]
+
+        def remove_labels(tx: neo4j.Transaction):
+            # one statement per label keeps the label scans, but all are committed at once
+            for label in labels:
+                tx.run(f"MATCH (n:{label}) REMOVE n:{label}")
+
+        self.session.write_transaction(remove_labels)
 
     def export_selection(self, node_ids: List[str], relationships: List[str]):
+        """
+        Fetch the selected nodes (with attributes) and relationships, one query each
+        """
         nodes = list(
             self.cypher(
                 "\n".join(
                     [
+                        "UNWIND $node_ids AS node_id",
                         "MATCH (n)",
-                        f"WHERE ID(n) in {[int(i) for i in node_ids]}",
+                        "WHERE ID(n) = node_id",
                         "OPTIONAL MATCH (n)--(a:Attr)",
                         "RETURN id(n), n, collect(a)",
                     ]
-                )
+                ),
+                node_ids=[int(i) for i in node_ids],
             )
         )
-        relationships = list(
-            self.cypher(
-                "\n".join(
-                    [
-                        f"MATCH ()-[r]-()",
-                        f"WHERE ID(r) in {[int(i) for i in relationships]}",
-                        "RETURN collect(r)",
-                    ]
-                )
-            )
-        )[0]
+        relationships = self.single(
+            "\n".join(
+                [
+                    "UNWIND $rel_ids AS rel_id",
+                    "MATCH ()-[r]->()",
+                    "WHERE ID(r) = rel_id",
+                    "RETURN collect(r)",
+                ]
+            ),
+            rel_ids=[int(i) for i in relationships],
+        )
         return nodes, relationships
 
 
 class Neo4jConnector:
+    """
+    Owns the driver and its connection pool, so create only one per process and share it
+    """
+
     def __init__(self, config: Neo4jConfig):
         self.logger = logging.getLogger("Neo4jConnector")
         self.config = config
-        self.driver = neo4j.GraphDatabase.driver(config.uri, auth=config.auth)
+        # the driver keeps a pool of bolt connections, sessions borrow from it
+        self.driver = neo4j.GraphDatabase.driver(
+            config.uri,
+            auth=config.auth,
+            max_connection_pool_size=config.max_connection_pool_size,
+            connection_acquisition_timeout=config.connection_acquisition_timeout,
+            max_connection_lifetime=config.max_connection_lifetime,
+            keep_alive=config.keep_alive,
+            fetch_size=config.fetch_size,
+        )
         self.driver.verify_connectivity()
 
-    def new_session(self) -> EtymGraphSession:
-        return EtymGraphSession(self.driver.session(database=self.config.database))
+    def new_session(self, fetch_size: int = None) -> EtymGraphSession:
+        """
+        :param fetch_size: records per pull, defaults to the configured one, -1 fetches all at once (for bulk reads)
+        """
+        return EtymGraphSession(
+            self.driver.session(
+                database=self.config.database,
+                fetch_size=fetch_size or self.config.fetch_size,
+            )
+        )
+
+    def read_tx(
+        self, fn: Callable[..., T], *args, fetch_size: int = None, **kwargs
+    ) -> T:
+        """
+        Run a read-only EtymGraphSession method in a managed transaction
+
+        The driver retries the transaction on transient errors, e.g. a stale pooled connection.
+
+        :param fn: called as fn(session, *args, **kwargs), e.g. EtymGraphSession.simple_query
+        :param fetch_size: see new_session
+        """
+        with self.driver.session(
+            database=self.config.database,
+            fetch_size=fetch_size or self.config.fetch_size,
+        ) as session:
+            return session.read_transaction(
+                lambda tx: fn(EtymGraphSession(tx), *args, **kwargs)
+            )
+
+    def get_db_constants(self, cache_file: Path = DBCONSTS_CACHE):
+        """
+        Languages, pos, gloss labels and node labels of the db
+
+        The values are cached on disk, where they are only queried again if the db fingerprint changed.
+
+        :return: tuple of (languages, pos, gloss_labels, node_labels)
+        """
+        key = f"{self.config.uri}/{self.config.database}"
+        try:
+            with open(cache_file) as src:
+                cache = json.load(src)
+        except (OSError, ValueError):
+            cache = {}
+        with self.new_session(fetch_size=-1) as session:
+            fingerprint = session.get_fingerprint()
+            cached = cache.get(key)
+            if cached and cached["fingerprint"] == fingerprint:
+                self.logger.info(f"Loaded db constants from {cache_file}")
+                return tuple(cached["values"])
+            values = (
+                session.get_all_languages(),
+                session.get_all_pos(),
+                session.get_glosslabels(),
+                session.get_node_labels(),
+            )
+        cache[key] = {"fingerprint": fingerprint, "values": values}
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(cache_file, "w") as dest:
+                json.dump(cache, dest)
+        except OSError as e:
+            self.logger.warning(f"Could not write db constants cache: {e}")
+        return values
@@ -1,26 +1,58 @@
-import hashlib
+import json
 import re
+import threading
+import zlib
+from collections import OrderedDict
 from typing import Tuple, List, Any, Union, Dict, Collection
 
 import numpy as np
 from dash import callback_context, html
 
+# group 1 is the italic, group 2 the bold text, <br/> has no group
+HTML_TAGS = re.compile("<i>(.*?)</i>|<b>(.*?)</b>|<br/>")
+
 
 def random_color(obj) -> Tuple:
     """
     Convert an object into a rgb-triple, based on it's hash
     """
-    h = int(hashlib.sha1(str(obj).encode("utf-8")).hexdigest(), 16)
-    rgb = []
-    for i in range(3):
-        rgb.append(h % 256)
-        h >>= 8
-    return tuple(rgb)
+    # a checksum is enough here, it only has to be stable across processes (unlike hash())
+    h = zlib.crc32(str(obj).encode("utf-8"))
+    return h & 0xFF, (h >> 8) & 0xFF, (h >> 16) & 0xFF
 
 
 Options = List[Dict[str, Any]]
 
 
+class LRUCache:
+    """
+    A small thread-safe mapping that evicts the least recently used entries
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
 def to_options(values: Union[List[Any], Dict[str, str]]) -> Options:
     if isinstance(values, List):
         return [{"label": v, "value": v} for v in values]
@@ -31,16 +63,24 @@ def get_trigger() -> Tuple[str, str]:
     return callback_context.triggered[0]["prop_id"].split(".")
 
 
+def stringify_id(id_: Union[str, dict]) -> str:
+    """
+    Serialize a component id like the dash renderer does for the triggered prop_id
+    """
+    if isinstance(id_, str):
+        return id_
+    return json.dumps(id_, sort_keys=True, separators=(",", ":"))
+
+
 def create_testdata(n=10, k=25):
     nodes = [
         {"data": {"id": str(i), "label": f"term{i}", "_color": random_color(i)}}
         for i in range(n)
     ]
+    pairs = np.random.default_rng().integers(0, n, size=(k, 2)).tolist()
     relationships = [
         {"data": {"source": str(i), "target": str(j), "_color": "red"}}
-        for i, j in zip(
-            np.random.choice(np.arange(n), k), np.random.choice(np.arange(n), k)
-        )
+        for i, j in pairs
     ]
     return [*nodes, *relationships]
 
@@ -61,8 +101,8 @@ def as_cypher_list(items: Collection):
     return f"[{items}]"
 
 
-def get_node_ids(cyto_elements: List[dict]):
-    return [int(e["data"]["id"]) for e in cyto_elements if "source" not in e["data"]]
+def get_node_ids(elements: Dict[str, Dict[str, dict]]):
+    return [int(id_) for id_ in elements["nodes"]]
 
 
 def text2display(text):
@@ -71,17 +111,20 @@ def text2display(text):
 
     (Could be implemented more efficient)
     """
+    if "<" not in text:
+        # most glosses are plain text
+        return [text] if text else []
     ret = []
     lastpos = 0
-    for t in re.finditer("(<i>(.*?)</i>|<b>(.*?)</b>|<br/>)", text):
+    for t in HTML_TAGS.finditer(text):
         if t.start() > lastpos:
             ret.append(text[lastpos : t.start()])
-        if t.group(0) == "<br/>":
-            ret.append(html.Br())
-        elif t.group(0).startswith("<i"):
-            ret.append(html.I(text2display(t.group(2))))
+        if t.lastindex == 1:
+            ret.append(html.I(text2display(t.group(1))))
+        elif t.lastindex == 2:
+            ret.append(html.B(text2display(t.group(2))))
         else:
-            ret.append(html.B(text2display(t.group(3))))
+            ret.append(html.Br())
         lastpos = t.end()
     if lastpos < len(text):
         ret.append(text[lastpos:])
@@ -1,14 +1,15 @@
 import csv
-import itertools
 import logging
 import re
 from collections import defaultdict
 from difflib import SequenceMatcher
+from functools import lru_cache
 from pathlib import Path
 from typing import List, Tuple, Mapping, Union
 
 import numpy as np
 import pandas as pd
+from joblib import Parallel, delayed
 from sklearn.linear_model import LogisticRegressionCV
 from sklearn.metrics import precision_recall_fscore_support
 from sklearn.preprocessing import StandardScaler
@@ -24,6 +25,13 @@ logging.basicConfig(level=logging.DEBUG)
 logging.getLogger("MongoEntryStore").setLevel(logging.INFO)
 logging.getLogger("matplotlib").setLevel(logging.INFO)
 
+WORD = re.compile(r"\w+")
+
+# the alpha values of the (fuzzy) tversky features, with their column names
+ALPHAS = np.linspace(0, 1, 51)
+TVERSKY_KEYS = [f"tversky_{alpha}" for alpha in ALPHAS]
+FUZZY_TVERSKY_KEYS = [f"fuzzy_tversky_{alpha}" for alpha in ALPHAS]
+
 
 class IdMergeListener(GlossMergeListener):
     """
@@ -130,9 +138,9 @@ class GlossSimilarityItemCollector:
 
     @staticmethod
     def _make_frame(data, labeled=False):
-        df = pd.DataFrame([(*k, *v) for k, values in data.items() for v in values])
-        df.columns = (
-            ["sense_idx", "definition", "def_pos", "def_labels"]
+        df = pd.DataFrame.from_records(
+            ((*k, *v) for k, values in data.items() for v in values),
+            columns=["sense_idx", "definition", "def_pos", "def_labels"]
             + (["match"] if labeled else [])
             + [
                 "term",
@@ -140,7 +148,7 @@ class GlossSimilarityItemCollector:
                 "temp_gloss",
                 "temp_pos",
                 "temp_qual",
-            ]
+            ],
         )
         df = df[
             (["match"] if labeled else [])
@@ -213,27 +221,55 @@ def get_argmax_prediction(probabilities, test: pd.DataFrame):
     t2 = test.reset_index()
     t2["probs"] = probabilities
     bg_cols = ["term", "lang", "temp_gloss", "definition"]
-    prediction = (
-        t2.groupby(["term", "lang", "temp_gloss"])
-        .definition.agg(lambda defs: defs.loc[t2.loc[defs.index].probs.idxmax()])
-        .reset_index()[bg_cols]
-    )
+    # the first row per template gloss after a stable sort is the (first) maximum
+    prediction = t2.sort_values(
+        "probs", ascending=False, kind="stable"
+    ).drop_duplicates(["term", "lang", "temp_gloss"])[bg_cols]
     prediction["argmax"] = 1
     t2 = t2.merge(prediction, left_on=bg_cols, right_on=bg_cols, how="left")
     t2.argmax.fillna(0, inplace=True)
     return t2.argmax
 
 
+def fit_univariate(
+    train_: np.ndarray, train: pd.DataFrame, test_: np.ndarray, cv=0
+) -> Tuple[LogisticRegressionCV, np.ndarray, np.ndarray]:
+    """
+    Fit a logistic regression on a single feature column
+
+    :return: triple of (model, pairwise predictions, probabilities) for the test column
+    """
+    scaler = StandardScaler().fit(train_)
+    params = {
+        "random_state": 33,
+        "solver": "lbfgs",
+        "multi_class": "ovr",
+        "max_iter": 100,
+        "class_weight": "balanced",
+    }
+    if cv:
+        LR = LogisticRegressionCV(cv=cv, **params).fit(
+            scaler.transform(train_), train.match
+        )
+    else:
+        LR = LogisticRegressionCV(**params).fit(scaler.transform(train_), train.match)
+    test_ = scaler.transform(test_)
+    return LR, LR.predict(test_), LR.predict_proba(test_)[:, 1]
+
+
 def get_univariate_predictions(
     train_featurized: pd.DataFrame,
     train: pd.Series,
     test_featurized: pd.DataFrame,
     test: pd.DataFrame,
     cv=0,
+    n_jobs=-1,
 ):
     """
     Make univariate logistic regression models, optionally crossvalidated
 
+    The columns are independent, so they are fitted in parallel (lbfgs releases the GIL, so threads suffice)
+
     :return: pair of (models, predictions)
     """
     models = {}
@@ -243,27 +279,18 @@ def get_univariate_predictions(
         ),
         index=range(len(test.index)),
     )
-    for col in train_featurized:
-        train_ = train_featurized.loc[:, col].values.reshape(-1, 1)
-        scaler = StandardScaler().fit(train_)
-        test_ = test_featurized.loc[:, col].values.reshape(-1, 1)
-        params = {
-            "random_state": 33,
-            "solver": "lbfgs",
-            "multi_class": "ovr",
-            "max_iter": 100,
-            "class_weight": "balanced",
-        }
-        if cv:
-            LR = LogisticRegressionCV(cv=cv, **params).fit(
-                scaler.transform(train_), train.match
-            )
-        else:
-            LR = LogisticRegressionCV(**params).fit(
-                scaler.transform(train_), train.match
-            )
-        predictions[col, "pairwise"] = LR.predict(scaler.transform(test_))
-        predictions[col, "prob"] = LR.predict_proba(scaler.transform(test_))[:, 1]
+    fitted = Parallel(n_jobs=n_jobs, prefer="threads")(
+        delayed(fit_univariate)(
+            train_featurized.loc[:, col].values.reshape(-1, 1),
+            train,
+            test_featurized.loc[:, col].values.reshape(-1, 1),
+            cv,
+        )
+        for col in train_featurized
+    )
+    for col, (LR, pairwise, probs) in zip(train_featurized, fitted):
+        predictions[col, "pairwise"] = pairwise
+        predictions[col, "prob"] = probs
         predictions[col, "argmax"] = get_argmax_prediction(
             predictions[col, "prob"], test
         ).values
@@ -333,37 +360,91 @@ def evaluate_predictions(predictions, test):
     return performance
 
 
+def tversky(t1, t2, t3) -> list:
+    """
+    The tversky index for all ALPHAS at once, given the (fuzzy) sizes of intersection and differences
+    """
+    if not t1:
+        return [0] * len(ALPHAS)
+    return (t1 / (t1 + ALPHAS * t2 + (1 - ALPHAS) * t3)).tolist()
+
+
+def sequence_match(a, b) -> Tuple[int, float]:
+    """
+    Size of the longest common block and the similarity ratio of two sequences
+    """
+    # identical glosses are common, so skip the matcher for them
+    if a == b:
+        return len(a), 1.0
+    seqmatcher = SequenceMatcher(a=a, b=b, autojunk=False)
+    return seqmatcher.find_longest_match(0, len(a), 0, len(b)).size, seqmatcher.ratio()
+
+
+def word_distances(words1, words2, maxlen=50) -> np.ndarray:
+    """
+    The levenshtein distances of all pairs of words as a matrix, one dynamic programming pass for all pairs
+
+    Like Levenshtein, -1 marks the pairs with a word of maxlen or more characters.
+    """
+
+    def encode(words):
+        lengths = np.array([len(w) for w in words], dtype=np.int64)
+        chars = np.full((len(words), lengths.max()), -1, dtype=np.int64)
+        for i, w in enumerate(words):
+            chars[i, : len(w)] = [ord(c) for c in w]
+        return chars, lengths
+
+    (chars1, lengths1), (chars2, lengths2) = encode(words1), encode(words2)
+    targets = np.arange(len(words2))
+    j = np.arange(chars2.shape[1] + 1)
+    # one levenshtein matrix row per pair of words, row i=0 is the distance to the empty prefix
+    row = np.broadcast_to(j, (len(words1), len(words2), len(j))).copy()
+    dist = row[:, targets, lengths2]
+    for i in range(chars1.shape[1]):
+        cost = chars1[:, i, None, None] != chars2[None, :, :]
+        candidate = np.empty_like(row)
+        candidate[..., 0] = i + 1
+        candidate[..., 1:] = np.minimum(row[..., 1:] + 1, row[..., :-1] + cost)
+        # insertions within the row: row[j] = min over k <= j of candidate[k] + (j - k)
+        row = np.minimum.accumulate(candidate - j, axis=-1) + j
+        done = lengths1 == i + 1
+        dist[done] = row[done][:, targets, lengths2]
+    too_long = (lengths1[:, None] >= maxlen) | (lengths2[None, :] >= maxlen)
+    return np.where(too_long, -1, dist)
+
+
 def featurize(defgloss, tempgloss, levenshtein=Levenshtein()):
     """
     Calculate all features for dev
+
+    The features are memoized per (normalized) gloss pair, clear them with featurize.cache_clear()
+
     :param defgloss:
     :param tempgloss:
-    :param levenshtein:
+    :param levenshtein: the edit distance, for Levenshtein the fuzzy features use the batched word_distances
     :return:
     """
+    return pd.Series(
+        _features(defgloss.strip().lower(), tempgloss.lower().strip(), levenshtein)
+    )
+
+
+@lru_cache(maxsize=2**16)
+def _features(defgloss, tempgloss, levenshtein) -> dict:
     ret = {}
-    defgloss = defgloss.strip().lower()
-    tempgloss = tempgloss.lower().strip()
     ret["char_eq"] = int(defgloss == tempgloss)
     ret["char_temp_in_def"] = int(tempgloss in defgloss)
     ret["char_def_in_temp"] = int(defgloss in tempgloss)
     char_lev = levenshtein(defgloss, tempgloss)
     ret["char_levenshtein"] = char_lev
     ret["char_levenshtein_co8"] = min(char_lev, 8)
-    dws = [w.lower() for w in re.findall(r"\w+", defgloss)]
-    tws = [w.lower() for w in re.findall(r"\w+", tempgloss)]
-    seqmatcher = SequenceMatcher(a=defgloss, b=tempgloss, autojunk=False)
-    ret["char_longest_match"] = seqmatcher.find_longest_match(
-        0, len(defgloss), 0, len(tempgloss)
-    ).size
-    ret["char_ratio"] = seqmatcher.ratio()
+    # the glosses are lowercased already
+    dws = WORD.findall(defgloss)
+    tws = WORD.findall(tempgloss)
+    ret["char_longest_match"], ret["char_ratio"] = sequence_match(defgloss, tempgloss)
 
     ret["word_eq"] = int(dws == tws)
-    seqmatcher = SequenceMatcher(a=dws, b=tws, autojunk=False)
-    ret["word_longest_match"] = seqmatcher.find_longest_match(
-        0, len(dws), 0, len(tws)
-    ).size
-    ret["word_ratio"] = seqmatcher.ratio()
+    ret["word_longest_match"], ret["word_ratio"] = sequence_match(dws, tws)
     ret["word_levenshtein"] = word_levenshtein = levenshtein(dws, tws)
     ret["word_levenshtein_co5"] = min(word_levenshtein, 5)
     dwss = set(dws)
@@ -375,26 +456,26 @@ def featurize(defgloss, tempgloss, levenshtein=Levenshtein()):
     t3 = len(twss - dwss)
     ret["word_temp_in_def"] = int(t3 == 0)
     ret["word_def_in_temp"] = int(t2 == 0)
-    for alpha in np.linspace(0, 1, 51):
-        ret[f"tversky_{alpha}"] = (
-            (t1 / (t1 + alpha * t2 + (1 - alpha) * t3)) if t1 else 0
-        )
+    ret.update(zip(TVERSKY_KEYS, tversky(t1, t2, t3)))
 
     # Fuzzy Tversky Index
-    ts = defaultdict(lambda: 0)
-    ds = defaultdict(lambda: 0)
-    for d, t in itertools.product(dwss, twss):
-        lev = levenshtein(d, t)
+    # best similarity of each word to any word of the other gloss
+    if dwss and twss:
+        if isinstance(levenshtein, Levenshtein):
+            lev = word_distances(list(dwss), list(twss), maxlen=levenshtein.maxlen)
+        else:
+            lev = np.array([[levenshtein(d, t) for t in twss] for d in dwss])
         dist = 1 / (1 + lev)
-        ds[d] = max(ds[d], dist)
-        ts[t] = max(ts[t], dist)
-
-    t1 = (sum(ds[w] for w in dwss) + sum(ts[w] for w in twss)) / 2
-    t2 = sum(1 - ds[w] for w in dwss)
-    t3 = sum(1 - ts[w] for w in twss)
-    for alpha in np.linspace(0, 1, 51):
-        ret[f"fuzzy_tversky_{alpha}"] = (
-            (t1 / (t1 + alpha * t2 + (1 - alpha) * t3)) if t1 else 0
-        )
+        ds, ts = dist.max(axis=1), dist.max(axis=0)
+    else:
+        ds, ts = np.zeros(len(dwss)), np.zeros(len(twss))
+
+    t1 = (ds.sum() + ts.sum()) / 2
+    t2 = (1 - ds).sum()
+    t3 = (1 - ts).sum()
+    ret.update(zip(FUZZY_TVERSKY_KEYS, tversky(t1, t2, t3)))
+
+    return ret
+
 
-    return pd.Series(ret)
+featurize.cache_clear = _features.cache_clear
@@ -1,6 +1,8 @@
+import multiprocessing as mp
 import re
 from collections import defaultdict, Counter
-from typing import List
+from itertools import islice
+from typing import List, Iterable, Iterator, Tuple, Dict
 
 import wikitextparser as wtp
 from tqdm import tqdm
@@ -12,12 +14,20 @@ from etymmap.utils import tFlexStr
 from etymmap.wiktionary import Wiktionary
 
 
+SECTION_PREFIXES = ("etym", "desc", "deriv", "related")
+SECTIONS = re.compile(f"({'|'.join(SECTION_PREFIXES)}).*", re.I)
+
+
 def count_sections(wiktionary: Wiktionary):
     section_count = defaultdict(Counter)
-    sections = re.compile("(etym|desc|deriv|related).*", re.I)
-    for section, *_ in tqdm(wiktionary.sections(sections), total=2.34 * 10**6):
+    for section, *_ in tqdm(wiktionary.sections(SECTIONS), total=2.34 * 10**6):
         subsection = section[-1]
-        section_count[sections.match(subsection).group(1).lower()][subsection] += 1
+        # cheaper than matching the regex again for every section
+        lowered = subsection.lower()
+        for prefix in SECTION_PREFIXES:
+            if lowered.startswith(prefix):
+                section_count[prefix][subsection] += 1
+                break
     return section_count
 
 
@@ -26,20 +36,51 @@ def section_examples(wiktionary: Wiktionary, section: tFlexStr, n=3) -> List[str
     return [next(section_iter)[1] for _ in range(n)]
 
 
-def template_counts_by_section(wiktionary: Wiktionary):
+def batched(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def count_templates(sections: List[Tuple[str, str]]) -> Dict[str, Counter]:
+    """
+    Count the templates and wikilinks of a batch of (section name, text) pairs
+    """
     template_name_by_section = defaultdict(Counter)
     all_etym_sections = consts.ALL_ETYMOLOGY_SECTIONS
-    for section, text, ctx in tqdm(
-        wiktionary.sections(all_etym_sections), total=2.34 * 10**6
-    ):
+    for name, text in sections:
         parsed = wtp.parse(text)
-        section_name = all_etym_sections.match(section[-1]).group(1)
+        section_name = all_etym_sections.match(name).group(1)
         for template in parsed.templates:
             template_name_by_section[section_name][template.name.strip()] += 1
         template_name_by_section[section_name]["WIKILINK"] += len(parsed.wikilinks)
     return template_name_by_section
 
 
+def template_counts_by_section(
+    wiktionary: Wiktionary,
+    processes: int = max(1, mp.cpu_count() - 1),
+    batch_size: int = 1000,
+):
+    """
+    Parsing dominates here, so the sections are parsed in batches by a process pool
+    """
+    template_name_by_section = defaultdict(Counter)
+    sections = (
+        (section[-1], text)
+        for section, text, ctx in tqdm(
+            wiktionary.sections(consts.ALL_ETYMOLOGY_SECTIONS), total=2.34 * 10**6
+        )
+    )
+    with mp.Pool(processes=processes) as pool:
+        for counts in pool.imap_unordered(
+            count_templates, batched(sections, batch_size)
+        ):
+            for section_name, counter in counts.items():
+                template_name_by_section[section_name].update(counter)
+    return template_name_by_section
+
+
 spec_types = ["origin", "sibling", "related", "stub", "unhandled"]
 
 
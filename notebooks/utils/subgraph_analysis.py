@@ -1,4 +1,6 @@
+import multiprocessing as mp
 from collections import Counter
+from functools import partial, lru_cache, cached_property
 from typing import Tuple
 
 import matplotlib.pyplot as plt
@@ -7,6 +9,7 @@ import numpy as np
 import pandas as pd
 import tqdm
 from pandas import DataFrame
+from scipy.sparse.csgraph import connected_components
 
 from etymmap.extraction import EtymologyExtractor, SectionExtractor
 from etymmap.graph import (
@@ -18,6 +21,55 @@ from etymmap.specific import Specific
 from etymmap.specific_en.languages import load_phylogenetic_tree
 
 
+class NodeArrays:
+    """
+    Column-wise view of the nodes of a graph, built once per call and passed to the helpers
+
+    Not cached on the graph: copies and subgraph views share the graph attributes, and mutations keep stale positions.
+
+    The i-th entry of each column belongs to the i-th node in graph order, index maps the nodes to their position.
+    The columns are built on first access, so each helper only pays for the ones it reads.
+    """
+
+    def __init__(self, graph: nx.Graph):
+        self.nodes = list(graph.nodes)
+
+    @cached_property
+    def index(self) -> dict:
+        return {node: i for i, node in enumerate(self.nodes)}
+
+    @cached_property
+    def ids(self) -> list:
+        return [node.id for node in self.nodes]
+
+    @cached_property
+    def is_lexeme(self) -> np.ndarray:
+        return np.array(
+            [isinstance(node, LexemeBase) for node in self.nodes], dtype=bool
+        )
+
+    @cached_property
+    def languages(self) -> np.ndarray:
+        return np.array(
+            [
+                node.language if is_lexeme else None
+                for node, is_lexeme in zip(self.nodes, self.is_lexeme)
+            ],
+            dtype=object,
+        )
+
+    def __len__(self):
+        return len(self.nodes)
+
+
+@lru_cache(maxsize=1)
+def phylogenetic_tree() -> nx.DiGraph:
+    """
+    The language tree is only read by the relation store, so one instance is shared by all extractions
+    """
+    return load_phylogenetic_tree()
+
+
 def apply_extractor(
         *section_extractors: SectionExtractor,
         head: int = None,
@@ -34,7 +86,7 @@ def apply_extractor(
     :return: the EtymologyExtractor that performed the extraction
     """
     if swap_historic_languages:
-        language_tree = load_phylogenetic_tree()
+        language_tree = phylogenetic_tree()
     else:
         language_tree = None
     extractor = EtymologyExtractor(
@@ -53,24 +105,32 @@ def describe(graph: nx.DiGraph):
     :param graph:
     :return: tuple of info, component_sizes, main_components
     """
-    big_components = []
-    component_sizes = []
-    for comp in nx.algorithms.weakly_connected_components(graph):
-        l = len(comp)
-        component_sizes.append(l)
-        big_components.append(comp)
-        big_components = sorted(big_components, key=len, reverse=True)[:3]
-    component_sizes = pd.Series(component_sizes)
+    nodes = NodeArrays(graph)
+    n_nodes = len(nodes)
+    # label the weak components in one pass over the sparse adjacency, instead of building a set per component
+    adjacency = nx.to_scipy_sparse_array(
+        graph, nodelist=nodes.nodes, weight=None, format="csr"
+    )
+    _, labels = connected_components(adjacency, directed=True, connection="weak")
+    sizes = np.bincount(labels).astype(np.int64)
+    # only the biggest components are materialized, ties in order of discovery
+    big_components = [
+        {nodes.nodes[i] for i in np.flatnonzero(labels == label)}
+        for label in np.argsort(-sizes, kind="stable")[:3]
+    ]
+    component_sizes = pd.Series(sizes)
     return (
         {
-            "n_nodes": graph.number_of_nodes(),
+            "n_nodes": n_nodes,
             "n_edges": graph.number_of_edges(),
-            "n_components": len(component_sizes),
+            "n_components": len(sizes),
             "component_size": {
-                "mode": component_sizes.mode()[0],
-                **component_sizes.agg(["mean", "min", "max"]).to_dict(),
+                "mode": int(np.bincount(sizes).argmax()),
+                "mean": sizes.mean(),
+                "min": sizes.min(),
+                "max": sizes.max(),
                 # expected value for the component size of a node
-                "expected_size": (component_sizes ** 2).sum() / graph.number_of_nodes(),
+                "expected_size": (sizes ** 2).sum() / n_nodes,
             },
         },
         component_sizes,
@@ -79,10 +139,9 @@ def describe(graph: nx.DiGraph):
 
 
 def show_component_sizes(component_sizes, bins=np.logspace(1, 6, 25)):
-    component_sizes_per_node = Counter(
-        {c: c * v for c, v in Counter(component_sizes).items()}
-    ).elements()
-    pd.Series(component_sizes_per_node).hist(bins=bins)
+    # each component size once per node of the component
+    sizes = np.asarray(component_sizes, dtype=np.int64)
+    pd.Series(np.repeat(sizes, sizes)).hist(bins=bins)
     plt.gca().set_xscale("log")
 
 
@@ -96,19 +155,24 @@ def show_languages_in_component(component, n=25):
     ).plot(kind="bar")
 
 
+@lru_cache(maxsize=None)
+def language_name(code: str) -> str:
+    """
+    The canonical name of a language code, or the code itself if it is unknown (cached across graphs)
+    """
+    try:
+        return Specific.language_mapper.code2name(code)
+    except KeyError:
+        return code
+
+
 def language_counts(graph: nx.MultiDiGraph) -> pd.DataFrame:
-    languages = pd.Series(
-        Counter(l.language for l in graph if isinstance(l, LexemeBase))
-    ).sort_values(ascending=False)
+    nodes = NodeArrays(graph)
+    # lexemes without a language are counted as well
+    languages = pd.Series(nodes.languages[nodes.is_lexeme]).value_counts(dropna=False)
     ret = pd.concat([languages, (languages / languages.sum())], axis=1)
     ret.columns = ["count", "ratio"]
-    langs = []
-    for l in ret.index:
-        try:
-            langs.append(Specific.language_mapper.code2name(l))
-        except KeyError:
-            langs.append(l)
-    ret.index = langs
+    ret.index = ret.index.map(language_name)
     return ret
 
 
@@ -119,16 +183,24 @@ def in_out_degree_grid(graph: nx.MultiDiGraph) -> Tuple[dict, DataFrame]:
     :param graph:
     :return:
     """
-    degrees = {}
-    for node, indeg in graph.in_degree:
-        degrees[node.id] = indeg
-    for node, outdeg in graph.out_degree:
-        degrees[node.id] = degrees[node.id], outdeg
-    degree_grid = (
-        pd.Series(Counter(degrees.values())).unstack(level=1, fill_value=0).astype(int)
+    nodes = NodeArrays(graph)
+    # parallel edges are summed up in the matrix entries, so the row / column sums are the degrees
+    adjacency = nx.to_scipy_sparse_array(
+        graph, nodelist=nodes.nodes, weight=None, format="csr"
+    )
+    in_degrees = np.asarray(adjacency.sum(axis=0)).ravel().astype(np.int64)
+    out_degrees = np.asarray(adjacency.sum(axis=1)).ravel().astype(np.int64)
+    degrees = dict(zip(nodes.ids, zip(in_degrees.tolist(), out_degrees.tolist())))
+    grid = np.zeros((in_degrees.max() + 1, out_degrees.max() + 1), dtype=np.int64)
+    np.add.at(grid, (in_degrees, out_degrees), 1)
+    # only keep the degrees that occur
+    in_values = np.flatnonzero(grid.any(axis=1))
+    out_values = np.flatnonzero(grid.any(axis=0))
+    degree_grid = pd.DataFrame(
+        grid[np.ix_(in_values, out_values)],
+        index=pd.Index(in_values, name="in"),
+        columns=pd.Index(out_values, name="out"),
     )
-    degree_grid.index.name = "in"
-    degree_grid.columns = pd.Series(degree_grid.columns, name="out")
     return degrees, degree_grid
 
 
@@ -138,75 +210,186 @@ def redundancy(graph: nx.Graph, reduction_listener: StoringReductionListener):
     return redundant / (graph.number_of_edges() + redundant)
 
 
-def shortest_paths_to_connected_nodes(source, graph, cutoff):
-    node_shortest_paths = pd.Series(
-        nx.single_source_shortest_path_length(graph, source, cutoff=cutoff),
-        dtype=int,
-    ).iloc[1:]
-    return (source.id, 0 if len(node_shortest_paths) == 0 else node_shortest_paths.mean(), len(node_shortest_paths))
+def to_csr(graph: nx.DiGraph, nodes: list) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Snapshot of the out-adjacency as CSR arrays (indptr, indices), nodes are referred to by their position in nodes
+    """
+    adjacency = nx.to_scipy_sparse_array(
+        graph, nodelist=nodes, weight=None, format="csr"
+    )
+    return adjacency.indptr, adjacency.indices
+
+
+# the CSR arrays of the graph in shortest_paths and a visited mask, set once per worker process
+CSR = None
+
+
+def init_csr(indptr: np.ndarray, indices: np.ndarray):
+    global CSR
+    CSR = indptr, indices, np.zeros(len(indptr) - 1, dtype=bool)
+
+
+def shortest_paths_to_connected_nodes(source: int, cutoff=None) -> Tuple[float, int]:
+    """
+    Level-synchronous BFS over the CSR snapshot of the worker, each level is expanded with array operations
+
+    :param source: the index of the source node
+    :return: pair of (average shortest path length, number of reachable nodes)
+    """
+    indptr, indices, visited = CSR
+    frontier = np.array([source])
+    visited[frontier] = True
+    levels = [frontier]
+    depth = total = 0
+    while frontier.size and (cutoff is None or depth < cutoff):
+        depth += 1
+        starts = indptr[frontier]
+        lengths = indptr[frontier + 1] - starts
+        # positions of all out-edges of the frontier in indices
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(
+            lengths.sum()
+        )
+        neighbors = np.unique(indices[offsets])
+        frontier = neighbors[~visited[neighbors]]
+        visited[frontier] = True
+        levels.append(frontier)
+        total += depth * frontier.size
+    # reset only the touched part of the mask, it is reused for the next source
+    for level in levels:
+        visited[level] = False
+    n_reachable = sum(level.size for level in levels) - 1
+    return (total / n_reachable if n_reachable else 0), n_reachable
 
 
 def shortest_paths(
-        graph: nx.MultiDiGraph, cutoff=None, frac=1.0
+        graph: nx.MultiDiGraph,
+        cutoff=None,
+        frac=1.0,
+        processes: int = max(1, mp.cpu_count() - 1),
+        rng: np.random.Generator = None,
 ):
-    all_nodes = np.array(graph.nodes)
+    """
+    Shortest path stats for (a sample of) the nodes, the BFS runs in a process pool on a CSR snapshot of the graph
+
+    :param rng: the random generator for the sample, pass a seeded one for reproducible samples
+    """
+    nodes = NodeArrays(graph)
+    n = len(nodes)
+    # sample positions in the node arrays, not the node objects
     if frac < 1:
-        sample = np.random.choice(all_nodes, int(graph.number_of_nodes() * frac), replace=False)
+        rng = rng or np.random.default_rng()
+        # without shuffling, a sample much smaller than n is drawn without permuting all positions
+        sample = rng.choice(n, int(n * frac), replace=False, shuffle=False)
     else:
-        sample = all_nodes
+        sample = np.arange(n)
+    sample = sample.tolist()
+    with mp.Pool(
+            processes=processes, initializer=init_csr, initargs=to_csr(graph, nodes.nodes)
+    ) as pool:
+        stats = list(
+            tqdm.tqdm(
+                pool.imap(
+                    partial(shortest_paths_to_connected_nodes, cutoff=cutoff),
+                    sample,
+                    chunksize=64,
+                ),
+                total=len(sample),
+                unit=" nodes",
+            )
+        )
     return pd.DataFrame.from_records(
-        [shortest_paths_to_connected_nodes(node, graph, cutoff) for node in
-         tqdm.tqdm(sample, total=len(sample), unit=" nodes")],
+        [(nodes.ids[i], *node_stats) for i, node_stats in zip(sample, stats)],
         columns=["node", "avg_shortest_path", "n_reachable_nodes"])
 
 
+def overlap(
+        left: np.ndarray, right: np.ndarray, n_examples: int
+) -> Tuple[tuple, np.ndarray, np.ndarray]:
+    """
+    Compare the items of left (with repetitions) to the distinct items of right
+
+    :return: triple of ((intersection, only_left, only_right), only left examples, only right examples)
+    """
+    right = np.unique(right)
+    if not len(left) or not len(right):
+        return (0, len(left), len(right)), left[:n_examples], right[:n_examples]
+    in_right = np.isin(left, right)
+    intersection = np.unique(left[in_right]).size
+    return (
+        (intersection, len(left) - intersection, len(right) - intersection),
+        left[~in_right][:n_examples],
+        right[~np.isin(right, left)][:n_examples],
+    )
+
+
+# edges are packed into a single int64 key: the source index above the target index (28 bits each),
+# typed edges additionally carry the relation type index in the lowest 8 bits
+EDGE_SHIFT = 28
+EDGE_MASK = (1 << EDGE_SHIFT) - 1
+TYPE_BITS = 8
+
+
 def get_overlap(
         graph1: nx.MultiDiGraph, graph2: nx.MultiDiGraph, n_examples=100
 ) -> Tuple[pd.DataFrame, dict]:
+    # the node ids of both graphs are mapped to a common integer index, so that sorted array set operations apply
+    id2idx = {}
+    type2idx = {}
+
+    def node_array(arrays: NodeArrays) -> np.ndarray:
+        return np.array(
+            [id2idx.setdefault(id_, len(id2idx)) for id_ in arrays.ids],
+            dtype=np.int64,
+        )
+
+    def edge_arrays(
+            graph: nx.MultiDiGraph, arrays: NodeArrays, nodes: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The untyped and typed edge keys, from a single pass over the edges
+        """
+        # the endpoints are looked up by their position in the graph, and then translated to the common index
+        index = arrays.index
+        ends = np.array(
+            [
+                (index[n1], index[n2], type2idx.setdefault(reltype.name, len(type2idx)))
+                for n1, n2, reltype in graph.edges
+            ],
+            dtype=np.int64,
+        ).reshape(-1, 3)
+        edges = (nodes[ends[:, 0]] << EDGE_SHIFT) | nodes[ends[:, 1]]
+        return edges, (edges << TYPE_BITS) | ends[:, 2]
+
+    arrays1, arrays2 = NodeArrays(graph1), NodeArrays(graph2)
+    nodes1, nodes2 = node_array(arrays1), node_array(arrays2)
+    if len(id2idx) > EDGE_MASK:
+        raise ValueError(f"Too many nodes to pack the edges: {len(id2idx)}")
+    (edges1, typed_edges1), (edges2, typed_edges2) = (
+        edge_arrays(graph1, arrays1, nodes1),
+        edge_arrays(graph2, arrays2, nodes2),
+    )
+    if len(type2idx) > 1 << TYPE_BITS:
+        raise ValueError(f"Too many relation types to pack the edges: {len(type2idx)}")
+    node_overlap, only_left_nodes, only_right_nodes = overlap(
+        nodes1, nodes2, n_examples
+    )
+    edge_overlap, only_left_edges, only_right_edges = overlap(
+        edges1, edges2, n_examples
+    )
+    edge_overlap_typed, *_ = overlap(typed_edges1, typed_edges2, n_examples)
+    idx2id = list(id2idx)
     examples = {
-        "only_left_nodes": [],
-        "only_right_nodes": [],
-        "only_left_edges": [],
-        "only_right_edges": [],
+        "only_left_nodes": [idx2id[n] for n in only_left_nodes.tolist()],
+        "only_right_nodes": [idx2id[n] for n in only_right_nodes.tolist()],
+        "only_left_edges": [
+            (idx2id[key >> EDGE_SHIFT], idx2id[key & EDGE_MASK])
+            for key in only_left_edges.tolist()
+        ],
+        "only_right_edges": [
+            (idx2id[key >> EDGE_SHIFT], idx2id[key & EDGE_MASK])
+            for key in only_right_edges.tolist()
+        ],
     }
-    # node overlap
-    intersection = only_left = 0
-    nodes2 = {node.id for node in graph2.nodes}
-    for n in (node.id for node in graph1.nodes):
-        if n in nodes2:
-            intersection += 1
-            nodes2.remove(n)
-        else:
-            only_left += 1
-            if len(examples["only_left_nodes"]) < n_examples:
-                examples["only_left_nodes"].append(n)
-    node_overlap = (intersection, only_left, len(nodes2))
-    examples["only_right_nodes"] = list(nodes2)[:n_examples]
-    del nodes2
-    # edge overlap
-    intersection = only_left = 0
-    rels2 = set((n1.id, n2.id) for (n1, n2, type_) in graph2.edges)
-    for n in ((n1.id, n2.id) for (n1, n2, type_) in graph1.edges):
-        if n in rels2:
-            intersection += 1
-            rels2.remove(n)
-        else:
-            if len(examples["only_left_edges"]) < n_examples:
-                examples["only_left_edges"].append(n)
-            only_left += 1
-    edge_overlap = (intersection, only_left, len(rels2))
-    examples["only_right_edges"] = list(rels2)[:n_examples]
-    rels2.clear()
-    # typed edge overlap
-    intersection = only_left = 0
-    rels2 = {(n1.id, n2.id, reltype.name) for n1, n2, reltype in graph2.edges}
-    for edge in ((n1.id, n2.id, reltype.name) for n1, n2, reltype in graph1.edges):
-        if edge in rels2:
-            intersection += 1
-            rels2.remove(edge)
-        else:
-            only_left += 1
-    edge_overlap_typed = (intersection, only_left, len(rels2))
     return (
         pd.DataFrame(
             {
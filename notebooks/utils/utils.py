@@ -1,13 +1,98 @@
+import mmap
 import os
 import pickle
+import struct
+import tempfile
+from pathlib import Path
+
+import joblib
+
+# frame header of the .npkl format: the length of the following frame
+FRAME_LENGTH = struct.Struct("<Q")
+
+
+def open_cache(file, mode):
+    """
+    Open a cache file, files ending in .lz4 are (de)compressed with lz4 (needs the lz4 package)
+    """
+    if Path(file).suffix == ".lz4":
+        import lz4.frame
+
+        return lz4.frame.open(file, mode)
+    return open(file, mode, buffering=1 << 20)
+
+
+def dump_with_buffers(obj, file):
+    """
+    Pickle with protocol 5 and write the large buffers (e.g. numpy arrays) out-of-band, without copying them
+
+    Layout: the number of buffers, then the pickle and each buffer as length-prefixed frames.
+    """
+    buffers = []
+    data = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+    with open(file, "wb") as dest:
+        dest.write(FRAME_LENGTH.pack(len(buffers)))
+        for frame in [data, *(buffer.raw() for buffer in buffers)]:
+            dest.write(FRAME_LENGTH.pack(len(frame)))
+            dest.write(frame)
+
+
+def load_with_buffers(file):
+    """
+    Load a file written by dump_with_buffers, the buffers are views into a (copy-on-write) memory map of the file
+    """
+    with open(file, "rb") as src:
+        mapped = memoryview(mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_COPY))
+    (n_buffers,), pos = FRAME_LENGTH.unpack_from(mapped), FRAME_LENGTH.size
+    frames = []
+    for _ in range(n_buffers + 1):
+        (length,) = FRAME_LENGTH.unpack_from(mapped, pos)
+        pos += FRAME_LENGTH.size
+        frames.append(mapped[pos : pos + length])
+        pos += length
+    data, *buffers = frames
+    return pickle.loads(data, buffers=buffers)
 
 
 def cached(f, file, refresh=False):
+    """
+    Load the pickled result of f from file, or compute and store it
+
+    Files ending in .npkl are written with out-of-band buffers (see dump_with_buffers) and memory mapped on load.
+    Files ending in .joblib are written with joblib, their numpy arrays are loaded as read-only memory maps.
+    """
+    suffix = Path(file).suffix
+    out_of_band = suffix == ".npkl"
+    with_joblib = suffix == ".joblib"
     if os.path.isfile(file) and not refresh:
-        with open(file, "rb") as src:
+        if out_of_band:
+            return load_with_buffers(file)
+        if with_joblib:
+            return joblib.load(file, mmap_mode="r")
+        with open_cache(file, "rb") as src:
             obj = pickle.load(src)
     else:
-        with open(file, "wb") as dest:
-            obj = f()
-            pickle.dump(obj, dest)
+        obj = f()
+        # write to a temporary file first, so that a failing dump does not leave a truncated cache
+        fd, tmp = tempfile.mkstemp(
+            suffix=Path(file).suffix, dir=os.path.dirname(os.path.abspath(file))
+        )
+        os.close(fd)
+        try:
+            if out_of_band:
+                dump_with_buffers(obj, tmp)
+            elif with_joblib:
+                # uncompressed, compressed files cannot be memory mapped
+                joblib.dump(obj, tmp, protocol=pickle.HIGHEST_PROTOCOL)
+            else:
+                with open_cache(tmp, "wb") as dest:
+                    pickle.dump(obj, dest, protocol=pickle.HIGHEST_PROTOCOL)
+            # mkstemp creates the file with mode 0600, use the permissions of a plain open instead
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp, 0o666 & ~umask)
+            os.replace(tmp, file)
+        except BaseException:
+            os.remove(tmp)
+            raise
     return obj